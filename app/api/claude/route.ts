@@ -89,7 +89,7 @@ The answer is 42.
 
 Remember: Use mood tags when emotional expression enhances learning. For simple factual responses, tags are optional.`;
 
-const ALLOWED_MODELS = [
+const ALLOWED_MODELS = new Set([
   'claude-sonnet-4-5',
   'claude-sonnet-4-5-20250929',
   'claude-haiku-4-5',
@@ -100,7 +100,25 @@ const ALLOWED_MODELS = [
   'claude-3-opus-20240229',
   'claude-3-sonnet-20240229',
   'claude-3-haiku-20240307'
-];
+]);
+
+const PREFLIGHT_HEADERS = {
+  'Access-Control-Allow-Origin': '*',
+  'Access-Control-Allow-Methods': 'POST, OPTIONS',
+  'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+  'Access-Control-Max-Age': '86400',
+};
+
+/**
+ * Relay an upstream JSON response (success or error) without parsing and
+ * re-serializing it.
+ */
+function passThrough(response: Response) {
+  return new NextResponse(response.body, {
+    status: response.status,
+    headers: { 'Content-Type': response.headers.get('Content-Type') || 'application/json' }
+  });
+}
 
 export async function POST(request: NextRequest) {
   try {
@@ -108,11 +126,11 @@ export async function POST(request: NextRequest) {
     const { model, max_tokens, messages, stream, custom_system_prompt } = body;
 
     // Validate model
-    if (!model || !ALLOWED_MODELS.includes(model)) {
+    if (!model || !ALLOWED_MODELS.has(model)) {
       return NextResponse.json(
         {
           error: 'Invalid model',
-          details: { model: [`Must be one of: ${ALLOWED_MODELS.join(', ')}`] }
+          details: { model: [`Must be one of: ${Array.from(ALLOWED_MODELS).join(', ')}`] }
         },
         { status: 400 }
       );
@@ -164,13 +182,7 @@ export async function POST(request: NextRequest) {
         })
       });
 
-      if (!response.ok) {
-        const errorData = await response.json();
-        return NextResponse.json(errorData, { status: response.status });
-      }
-
-      const data = await response.json();
-      return NextResponse.json(data);
+      return passThrough(response);
     }
 
     // Option 2: Call Claude API directly (if API key is set)
@@ -190,13 +202,7 @@ export async function POST(request: NextRequest) {
         })
       });
 
-      if (!response.ok) {
-        const errorData = await response.json();
-        return NextResponse.json(errorData, { status: response.status });
-      }
-
-      const data = await response.json();
-      return NextResponse.json(data);
+      return passThrough(response);
     }
 
     // No configuration found
@@ -217,13 +223,6 @@ export async function POST(request: NextRequest) {
   }
 }
 
-export async function OPTIONS(request: NextRequest) {
-  return new NextResponse(null, {
-    status: 200,
-    headers: {
-      'Access-Control-Allow-Origin': '*',
-      'Access-Control-Allow-Methods': 'POST, OPTIONS',
-      'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-    },
-  });
+export async function OPTIONS() {
+  return new NextResponse(null, { status: 204, headers: PREFLIGHT_HEADERS });
 }
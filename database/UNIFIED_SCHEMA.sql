@@ -32,9 +32,10 @@ CREATE TABLE IF NOT EXISTS public.notebooks (
 );
 
 -- Indexes
-CREATE INDEX IF NOT EXISTS idx_notebooks_user_id ON public.notebooks(user_id);
+-- (user_id, created_at DESC) serves the user's most-recent-notebook lookup
+-- without a sort step, and also covers plain user_id lookups (RLS).
+CREATE INDEX IF NOT EXISTS idx_notebooks_user_created ON public.notebooks(user_id, created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_notebooks_updated_at ON public.notebooks(updated_at DESC);
-CREATE INDEX IF NOT EXISTS idx_notebooks_share_id ON public.notebooks(share_id) WHERE share_id IS NOT NULL;
 
 COMMENT ON TABLE public.notebooks IS 'User notebooks containing collections of drawings';
 COMMENT ON COLUMN public.notebooks.user_id IS 'References Supabase auth.users(id) - NO public.users table';
@@ -57,7 +58,9 @@ CREATE TABLE IF NOT EXISTS public.drawings (
 );
 
 -- Indexes
-CREATE INDEX IF NOT EXISTS idx_drawings_notebook_id ON public.drawings(notebook_id);
+-- (notebook_id, created_at DESC) returns a notebook's drawings already in
+-- order, and also covers plain notebook_id lookups (RLS, ON DELETE CASCADE).
+CREATE INDEX IF NOT EXISTS idx_drawings_notebook_created ON public.drawings(notebook_id, created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_drawings_created_at ON public.drawings(created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_drawings_is_ai ON public.drawings(is_ai_generated);
 
@@ -336,6 +339,15 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Trigger: Skip UPDATEs that don't change a notebook (e.g. auto-save PUTs).
+-- Triggers fire in name order, so this runs before the updated_at trigger
+-- below and a no-op write never bumps updated_at or writes a new tuple.
+DROP TRIGGER IF EXISTS suppress_redundant_notebook_updates ON public.notebooks;
+CREATE TRIGGER suppress_redundant_notebook_updates
+  BEFORE UPDATE ON public.notebooks
+  FOR EACH ROW
+  EXECUTE FUNCTION suppress_redundant_updates_trigger();
+
 -- Trigger: Update notebooks.updated_at
 DROP TRIGGER IF EXISTS update_notebooks_updated_at ON public.notebooks;
 CREATE TRIGGER update_notebooks_updated_at
@@ -429,6 +441,36 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql SECURITY DEFINER;
 
+-- ============================================================================
+-- Function: Cancel a subscription (called by the Stripe webhook)
+-- Clears the billing subscription and downgrades the tier in one transaction,
+-- so a webhook retry never finds the subscription cleared but the tier kept.
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION cancel_subscription(subscription_id_param TEXT)
+RETURNS UUID AS $$
+DECLARE
+  canceled_user_id UUID;
+BEGIN
+  UPDATE public.billing
+  SET
+    subscription_status = 'canceled',
+    stripe_subscription_id = NULL
+  WHERE stripe_subscription_id = subscription_id_param
+  RETURNING user_id INTO canceled_user_id;
+
+  IF canceled_user_id IS NOT NULL THEN
+    UPDATE public.user_settings
+    SET subscription_tier = 'free'
+    WHERE user_id = canceled_user_id;
+  END IF;
+
+  RETURN canceled_user_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+REVOKE EXECUTE ON FUNCTION cancel_subscription(TEXT) FROM PUBLIC, anon, authenticated;
+
 -- ============================================================================
 -- COMPLETE! 🎉
 -- ============================================================================
@@ -6,7 +6,7 @@ Trains a character-to-stroke LSTM model from handwriting samples collected
 via the training UI. Exports to ONNX for browser inference.
 
 Requirements:
-    pip install torch numpy onnx
+    pip install torch numpy onnx onnxruntime
 
 Usage:
     python train_lstm.py --input training-data.json --output model.onnx
@@ -14,13 +14,22 @@ Usage:
 
 import argparse
 import json
+import tempfile
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.utils.data import Dataset, DataLoader
 from pathlib import Path
 from typing import List, Dict, Tuple
 import onnx
+from onnxruntime.quantization import quantize_dynamic, QuantType
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+try:
+    import orjson  # Optional: much faster parsing of large training exports
+except ImportError:
+    orjson = None
 
 
 # ============================================================================
@@ -34,46 +43,41 @@ class HandwritingSample:
         self.points = points  # [{'x': float, 'y': float, 'pressure': float, 't': int}]
         self.metadata = metadata or {}
 
+        # Points parsed once into an (N, 3) array of (x, y, pressure)
+        self._xyp = np.array(
+            [(p['x'], p['y'], p.get('pressure', 0.5)) for p in points],
+            dtype=np.float64
+        ).reshape(-1, 3)
+
         # Extract emotional state from metadata
         self.emotional_state = metadata.get('emotional_state', 'neutral')
         self.intensity = metadata.get('intensity', 0.5)
 
     def to_sequence(self) -> np.ndarray:
         """Convert points to sequence of (dx, dy, pressure, pen_up) deltas"""
-        sequence = []
-        prev_x, prev_y = 0, 0
-
-        for i, point in enumerate(self.points):
-            x = point['x']
-            y = point['y']
-            pressure = point.get('pressure', 0.5)
+        sequence = np.zeros((len(self._xyp) + 1, 4), dtype=np.float32)
 
-            # Calculate deltas
-            dx = x - prev_x
-            dy = y - prev_y
-            pen_up = 0  # 0 = pen down, 1 = pen up
-
-            sequence.append([dx, dy, pressure, pen_up])
-
-            prev_x, prev_y = x, y
+        # Deltas from the previous point (the first point is relative to origin)
+        sequence[:-1, :2] = np.diff(self._xyp[:, :2], axis=0, prepend=0)
+        sequence[:-1, 2] = self._xyp[:, 2]  # pressure, pen_up stays 0 (pen down)
 
         # Add final pen-up marker
-        sequence.append([0, 0, 0, 1])
+        sequence[-1, 3] = 1
 
-        return np.array(sequence, dtype=np.float32)
+        return sequence
 
     @property
     def bounds(self) -> Dict:
         """Calculate bounding box"""
-        xs = [p['x'] for p in self.points]
-        ys = [p['y'] for p in self.points]
+        min_x, min_y = self._xyp[:, :2].min(axis=0)
+        max_x, max_y = self._xyp[:, :2].max(axis=0)
         return {
-            'minX': min(xs),
-            'maxX': max(xs),
-            'minY': min(ys),
-            'maxY': max(ys),
-            'width': max(xs) - min(xs),
-            'height': max(ys) - min(ys)
+            'minX': float(min_x),
+            'maxX': float(max_x),
+            'minY': float(min_y),
+            'maxY': float(max_y),
+            'width': float(max_x - min_x),
+            'height': float(max_y - min_y)
         }
 
 
@@ -93,34 +97,41 @@ class HandwritingDataset(Dataset):
         self.char_to_idx = char_to_idx
         self.max_seq_len = max(len(s.points) for s in samples) + 1  # +1 for pen-up
 
-    def __len__(self):
-        return len(self.samples)
-
-    def __getitem__(self, idx):
-        sample = self.samples[idx]
+        # Encode every sample once up front so epochs only index into tensors
+        num_samples = len(samples)
 
         # Character as one-hot encoded index
-        char_idx = self.char_to_idx[sample.character]
+        self.char_indices = torch.tensor(
+            [char_to_idx[s.character] for s in samples], dtype=torch.long
+        )
 
-        # Emotional state as index
-        emotion_idx = self.EMOTION_TO_IDX.get(sample.emotional_state, 0)  # Default to neutral
+        # Emotional state as index (default to neutral)
+        self.emotion_indices = torch.tensor(
+            [self.EMOTION_TO_IDX.get(s.emotional_state, 0) for s in samples], dtype=torch.long
+        )
 
         # Intensity as scalar
-        intensity = sample.intensity
+        self.intensities = torch.tensor([s.intensity for s in samples], dtype=torch.float32)
 
-        # Stroke sequence (dx, dy, pressure, pen_up)
-        sequence = sample.to_sequence()
+        # Stroke sequences (dx, dy, pressure, pen_up), zero-padded to max length
+        self.sequences = torch.zeros(num_samples, self.max_seq_len, 4)
+        self.seq_lens = torch.empty(num_samples, dtype=torch.long)
 
-        # Pad to max length
-        padded = np.zeros((self.max_seq_len, 4), dtype=np.float32)
-        padded[:len(sequence)] = sequence
+        for i, sample in enumerate(samples):
+            sequence = torch.from_numpy(sample.to_sequence())
+            self.sequences[i, :len(sequence)] = sequence
+            self.seq_lens[i] = len(sequence)
 
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
         return {
-            'char_idx': char_idx,
-            'emotion_idx': emotion_idx,
-            'intensity': intensity,
-            'sequence': torch.FloatTensor(padded),
-            'seq_len': len(sequence)
+            'char_idx': self.char_indices[idx],
+            'emotion_idx': self.emotion_indices[idx],
+            'intensity': self.intensities[idx],
+            'sequence': self.sequences[idx],
+            'seq_len': self.seq_lens[idx]
         }
 
 
@@ -173,10 +184,8 @@ class Char2StrokeLSTM(nn.Module):
             batch_first=True
         )
 
-        # Output projection
-        self.fc_dx_dy = nn.Linear(hidden_dim, 2)  # (dx, dy)
-        self.fc_pressure = nn.Linear(hidden_dim, 1)  # pressure (0-1)
-        self.fc_pen_up = nn.Linear(hidden_dim, 1)  # pen_up (sigmoid)
+        # Output projection (one GEMM for all heads): dx, dy, pressure, pen_up
+        self.fc_out = nn.Linear(hidden_dim, 4)
 
     def forward(self, char_idx, emotion_idx, intensity, prev_strokes, hidden=None):
         """
@@ -188,8 +197,11 @@ class Char2StrokeLSTM(nn.Module):
             hidden: Optional LSTM hidden state
 
         Returns:
-            predictions: (batch_size, seq_len, 4) predicted (dx, dy, pressure, pen_up)
+            predictions: (batch_size, seq_len, 4) predicted (dx, dy, pressure, pen_up_logit)
             hidden: LSTM hidden state
+
+        pen_up is returned as a logit so training can use BCEWithLogitsLoss;
+        Char2StrokeInference applies the sigmoid for export.
         """
         batch_size, seq_len, _ = prev_strokes.shape
 
@@ -214,32 +226,48 @@ class Char2StrokeLSTM(nn.Module):
         # LSTM
         lstm_out, hidden = self.lstm(lstm_input, hidden)  # (batch_size, seq_len, hidden_dim)
 
-        # Output projections
-        dx_dy = self.fc_dx_dy(lstm_out)  # (batch_size, seq_len, 2)
-        pressure = torch.sigmoid(self.fc_pressure(lstm_out))  # (batch_size, seq_len, 1) in [0, 1]
-        pen_up = torch.sigmoid(self.fc_pen_up(lstm_out))  # (batch_size, seq_len, 1) in [0, 1]
+        # Output projection, split into (dx, dy), pressure and pen_up
+        dx_dy, pressure, pen_up_logit = self.fc_out(lstm_out).split([2, 1, 1], dim=2)
 
-        # Concatenate predictions
-        predictions = torch.cat([dx_dy, pressure, pen_up], dim=2)  # (batch_size, seq_len, 4)
+        # Concatenate predictions (pressure squashed to [0, 1], pen_up left as a logit)
+        predictions = torch.cat([dx_dy, torch.sigmoid(pressure), pen_up_logit], dim=2)  # (batch_size, seq_len, 4)
 
         return predictions, hidden
 
 
+class Char2StrokeInference(nn.Module):
+    """
+    Inference wrapper around Char2StrokeLSTM
+
+    Converts the pen_up logit to a probability so exported models output
+    (dx, dy, pressure, pen_up) with pen_up in [0, 1].
+    """
+
+    def __init__(self, model: Char2StrokeLSTM):
+        super().__init__()
+        self.model = model
+
+    def forward(self, char_idx, emotion_idx, intensity, prev_strokes):
+        predictions, hidden = self.model(char_idx, emotion_idx, intensity, prev_strokes)
+        pen_up = torch.sigmoid(predictions[:, :, 3:4])
+        return torch.cat([predictions[:, :, :3], pen_up], dim=2), hidden
+
+
 # ============================================================================
 # Training Loop
 # ============================================================================
 
-def train_epoch(model, dataloader, optimizer, criterion, device):
-    """Train for one epoch"""
+def train_epoch(model, dataloader, optimizer, criterion, device, amp_dtype=None, scaler=None):
+    """Train for one epoch (mixed precision when amp_dtype is set)"""
     model.train()
-    total_loss = 0
+    total_loss = torch.zeros((), device=device)  # accumulated on-device, synced once per epoch
     num_batches = 0
 
     for batch in dataloader:
-        char_idx = batch['char_idx'].to(device)
-        emotion_idx = batch['emotion_idx'].to(device)
-        intensity = batch['intensity'].to(device)
-        sequence = batch['sequence'].to(device)
+        char_idx = batch['char_idx'].to(device, non_blocking=True)
+        emotion_idx = batch['emotion_idx'].to(device, non_blocking=True)
+        intensity = batch['intensity'].to(device, non_blocking=True)
+        sequence = batch['sequence'].to(device, non_blocking=True)
         seq_len = batch['seq_len']
 
         # Zero gradients
@@ -247,52 +275,57 @@ def train_epoch(model, dataloader, optimizer, criterion, device):
 
         # Forward pass (teacher forcing)
         # Input: previous strokes (shift by 1, start with zeros)
-        prev_strokes = torch.zeros_like(sequence)
-        prev_strokes[:, 1:, :] = sequence[:, :-1, :]
+        prev_strokes = F.pad(sequence[:, :-1, :], (0, 0, 1, 0))
 
-        predictions, _ = model(char_idx, emotion_idx, intensity, prev_strokes)
+        with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+            predictions, _ = model(char_idx, emotion_idx, intensity, prev_strokes)
 
-        # Loss (MSE for dx, dy, pressure + BCE for pen_up)
-        mse_loss = criterion['mse'](predictions[:, :, :3], sequence[:, :, :3])
-        bce_loss = criterion['bce'](predictions[:, :, 3:4], sequence[:, :, 3:4])
-        loss = mse_loss + bce_loss
+            # Loss (MSE for dx, dy, pressure + BCE on pen_up logits)
+            mse_loss = criterion['mse'](predictions[:, :, :3], sequence[:, :, :3])
+            bce_loss = criterion['bce'](predictions[:, :, 3:4], sequence[:, :, 3:4])
+            loss = mse_loss + bce_loss
 
-        # Backward pass
-        loss.backward()
-        optimizer.step()
+        # Backward pass (fp16 needs loss scaling, bf16/fp32 don't)
+        if scaler is not None:
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            loss.backward()
+            optimizer.step()
 
-        total_loss += loss.item()
+        total_loss += loss.detach()
         num_batches += 1
 
-    return total_loss / num_batches
+    return (total_loss / num_batches).item()
 
 
-def evaluate(model, dataloader, criterion, device):
+def evaluate(model, dataloader, criterion, device, amp_dtype=None):
     """Evaluate on validation set"""
     model.eval()
-    total_loss = 0
+    total_loss = torch.zeros((), device=device)  # accumulated on-device, synced once per epoch
     num_batches = 0
 
     with torch.no_grad():
         for batch in dataloader:
-            char_idx = batch['char_idx'].to(device)
-            emotion_idx = batch['emotion_idx'].to(device)
-            intensity = batch['intensity'].to(device)
-            sequence = batch['sequence'].to(device)
+            char_idx = batch['char_idx'].to(device, non_blocking=True)
+            emotion_idx = batch['emotion_idx'].to(device, non_blocking=True)
+            intensity = batch['intensity'].to(device, non_blocking=True)
+            sequence = batch['sequence'].to(device, non_blocking=True)
 
-            prev_strokes = torch.zeros_like(sequence)
-            prev_strokes[:, 1:, :] = sequence[:, :-1, :]
+            prev_strokes = F.pad(sequence[:, :-1, :], (0, 0, 1, 0))
 
-            predictions, _ = model(char_idx, emotion_idx, intensity, prev_strokes)
+            with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+                predictions, _ = model(char_idx, emotion_idx, intensity, prev_strokes)
 
-            mse_loss = criterion['mse'](predictions[:, :, :3], sequence[:, :, :3])
-            bce_loss = criterion['bce'](predictions[:, :, 3:4], sequence[:, :, 3:4])
-            loss = mse_loss + bce_loss
+                mse_loss = criterion['mse'](predictions[:, :, :3], sequence[:, :, :3])
+                bce_loss = criterion['bce'](predictions[:, :, 3:4], sequence[:, :, 3:4])
+                loss = mse_loss + bce_loss
 
-            total_loss += loss.item()
+            total_loss += loss.detach()
             num_batches += 1
 
-    return total_loss / num_batches
+    return (total_loss / num_batches).item()
 
 
 # ============================================================================
@@ -309,13 +342,13 @@ def export_to_onnx(model, char_to_idx, output_path):
     dummy_intensity = torch.tensor([0.5], dtype=torch.float32)
     dummy_prev_strokes = torch.zeros(1, 50, 4, dtype=torch.float32)  # Max seq length 50
 
-    # Export
+    # Export (wrapped so pen_up comes out as a probability, not a logit)
     torch.onnx.export(
-        model,
+        Char2StrokeInference(model).eval(),
         (dummy_char_idx, dummy_emotion_idx, dummy_intensity, dummy_prev_strokes),
         output_path,
         export_params=True,
-        opset_version=11,
+        opset_version=17,
         do_constant_folding=True,
         input_names=['char_idx', 'emotion_idx', 'intensity', 'prev_strokes'],
         output_names=['predictions'],
@@ -336,14 +369,42 @@ def export_to_onnx(model, char_to_idx, output_path):
     print("✅ ONNX model validated")
 
 
+def quantize_onnx(output_path) -> str:
+    """Write an INT8 (dynamic, weight-only) copy of the ONNX model for browser inference"""
+    quantized_path = str(Path(output_path).with_suffix('.int8.onnx'))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The exporter feeds LSTM weights through Slice/Concat nodes; pre-processing
+        # folds them back into initializers so quantize_dynamic can see them
+        preprocessed_path = str(Path(tmp_dir) / 'preprocessed.onnx')
+        quant_pre_process(output_path, preprocessed_path)
+
+        # Weights are stored as int8 and activations quantized on the fly, so no
+        # calibration data is needed
+        quantize_dynamic(
+            preprocessed_path,
+            quantized_path,
+            weight_type=QuantType.QInt8,
+            op_types_to_quantize=['MatMul', 'Gemm', 'LSTM'],
+        )
+
+    op_types = {node.op_type for node in onnx.load(quantized_path).graph.node}
+    if 'LSTM' in op_types or 'DynamicQuantizeLSTM' not in op_types:
+        Path(quantized_path).unlink()
+        raise RuntimeError(f"LSTM layers were not quantized in {quantized_path}")
+
+    print(f"✅ INT8 model exported to {quantized_path}")
+    return quantized_path
+
+
 # ============================================================================
 # Main
 # ============================================================================
 
 def load_training_data(json_path: str) -> Tuple[List[HandwritingSample], Dict]:
     """Load training data from JSON export"""
-    with open(json_path, 'r') as f:
-        data = json.load(f)
+    with open(json_path, 'rb') as f:
+        data = orjson.loads(f.read()) if orjson else json.load(f)
 
     samples = []
     characters = set()
@@ -375,12 +436,21 @@ def main():
     parser.add_argument('--lr', type=float, default=0.001, help='Learning rate')
     parser.add_argument('--hidden-dim', type=int, default=128, help='LSTM hidden dimension')
     parser.add_argument('--layers', type=int, default=2, help='Number of LSTM layers')
+    parser.add_argument('--no-amp', action='store_true', help='Disable mixed precision training on CUDA')
+    parser.add_argument('--compile', action='store_true', help='Train with torch.compile (fused kernels, CUDA graphs)')
     args = parser.parse_args()
 
     # Device
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     print(f"🔥 Using device: {device}")
 
+    # Mixed precision on CUDA: bf16 where supported, else fp16 with loss scaling
+    amp_dtype = None
+    if device.type == 'cuda' and not args.no_amp:
+        amp_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        print(f"⚡ Mixed precision: {amp_dtype}")
+    scaler = torch.amp.GradScaler('cuda') if amp_dtype == torch.float16 else None
+
     # Load data
     samples, char_to_idx, idx_to_char = load_training_data(args.input)
 
@@ -394,8 +464,10 @@ def main():
     train_dataset = HandwritingDataset(train_samples, char_to_idx)
     val_dataset = HandwritingDataset(val_samples, char_to_idx)
 
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False)
+    # Pinned host memory lets .to(device, non_blocking=True) overlap the copy with compute
+    pin_memory = device.type == 'cuda'
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, pin_memory=pin_memory)
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, pin_memory=pin_memory)
 
     # Model
     model = Char2StrokeLSTM(
@@ -410,16 +482,23 @@ def main():
     optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
     criterion = {
         'mse': nn.MSELoss(),
-        'bce': nn.BCELoss()
+        'bce': nn.BCEWithLogitsLoss()
     }
 
+    # The compiled wrapper shares parameters with `model`, which stays eager for
+    # checkpointing and ONNX export
+    train_model = model
+    if args.compile:
+        train_model = torch.compile(model, mode='reduce-overhead')
+        print("⚡ torch.compile enabled (first epoch includes compile time)")
+
     # Training loop
     print(f"\n🚀 Training for {args.epochs} epochs...")
     best_val_loss = float('inf')
 
     for epoch in range(args.epochs):
-        train_loss = train_epoch(model, train_loader, optimizer, criterion, device)
-        val_loss = evaluate(model, val_loader, criterion, device)
+        train_loss = train_epoch(train_model, train_loader, optimizer, criterion, device, amp_dtype, scaler)
+        val_loss = evaluate(train_model, val_loader, criterion, device, amp_dtype)
 
         print(f"Epoch {epoch+1}/{args.epochs} | Train Loss: {train_loss:.4f} | Val Loss: {val_loss:.4f}")
 
@@ -444,6 +523,13 @@ def main():
         }, f, indent=2)
 
     print(f"✅ Character and emotion mappings saved to {mapping_path}")
+
+    # The INT8 copy is optional; a quantization failure shouldn't discard the run
+    try:
+        quantize_onnx(args.output)
+    except Exception as e:
+        print(f"⚠️  Skipping INT8 model: {e}")
+
     print("\n🎉 Training complete!")
     print("\n📊 Emotional breakdown:")
 
@@ -6,11 +6,17 @@
 import { serve } from "https://deno.land/std@0.168.0/http/server.ts"
 import { createClient } from 'https://esm.sh/@supabase/supabase-js@2'
 
+// Provided by the Supabase Edge Runtime
+declare const EdgeRuntime: { waitUntil(promise: Promise<unknown>): void }
+
 const CLAUDE_API_KEY = Deno.env.get('CLAUDE_API_KEY')!
 const SUPABASE_URL = Deno.env.get('SUPABASE_URL')!
 const SUPABASE_SERVICE_ROLE_KEY = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!
 
-const ALLOWED_MODELS = [
+// Shared across requests to reuse connections
+const supabase = createClient(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+const ALLOWED_MODELS = new Set([
   // Claude 4.5 models (latest)
   'claude-sonnet-4-5',
   'claude-sonnet-4-5-20250929',
@@ -23,46 +29,38 @@ const ALLOWED_MODELS = [
   'claude-3-opus-20240229',
   'claude-3-sonnet-20240229',
   'claude-3-haiku-20240307'
-]
+])
+
+// CORS headers
+const corsHeaders = {
+  'Access-Control-Allow-Origin': '*',
+  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type',
+}
+const jsonHeaders = { ...corsHeaders, 'Content-Type': 'application/json' }
+// Browsers cache the preflight for a day
+const preflightHeaders = {
+  ...corsHeaders,
+  'Access-Control-Allow-Methods': 'POST, OPTIONS',
+  'Access-Control-Max-Age': '86400',
+}
 
 serve(async (req) => {
-  // CORS headers
-  const corsHeaders = {
-    'Access-Control-Allow-Origin': '*',
-    'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type',
-  }
-
   // Handle CORS preflight
   if (req.method === 'OPTIONS') {
-    return new Response(null, { headers: corsHeaders })
+    return new Response(null, { status: 204, headers: preflightHeaders })
   }
 
   try {
     // Get user from JWT (if authenticated)
     const authHeader = req.headers.get('Authorization')
     let userId: string | null = null
-    let userApiKey: string | null = null
 
     if (authHeader) {
       const token = authHeader.replace('Bearer ', '')
-      const supabase = createClient(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-
       const { data: { user }, error } = await supabase.auth.getUser(token)
 
       if (!error && user) {
         userId = user.id
-
-        // Check if user has their own API key
-        const { data: userData } = await supabase
-          .from('users')
-          .select('encrypted_api_key')
-          .eq('id', userId)
-          .single()
-
-        if (userData?.encrypted_api_key) {
-          // TODO: Decrypt user's API key if they have one
-          userApiKey = null  // For now, always use server key
-        }
       }
     }
 
@@ -71,15 +69,15 @@ serve(async (req) => {
     const { model, max_tokens, messages } = body
 
     // Validate model
-    if (!ALLOWED_MODELS.includes(model)) {
+    if (!ALLOWED_MODELS.has(model)) {
       return new Response(
         JSON.stringify({
           error: 'Invalid model',
-          details: { model: [`Must be one of: ${ALLOWED_MODELS.join(', ')}`] }
+          details: { model: [`Must be one of: ${Array.from(ALLOWED_MODELS).join(', ')}`] }
         }),
         {
           status: 400,
-          headers: { ...corsHeaders, 'Content-Type': 'application/json' }
+          headers: jsonHeaders
         }
       )
     }
@@ -93,20 +91,17 @@ serve(async (req) => {
         }),
         {
           status: 400,
-          headers: { ...corsHeaders, 'Content-Type': 'application/json' }
+          headers: jsonHeaders
         }
       )
     }
 
-    // Use user's API key if available, otherwise use server key
-    const apiKey = userApiKey || CLAUDE_API_KEY
-
     // Call Claude API
     const response = await fetch('https://api.anthropic.com/v1/messages', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'x-api-key': apiKey,
+        'x-api-key': CLAUDE_API_KEY,
         'anthropic-version': '2023-06-01'
       },
       body: JSON.stringify({
@@ -116,34 +111,39 @@ serve(async (req) => {
       })
     })
 
-    const data = await response.json()
-
-    // Track usage for billing (if using server API key and user is authenticated)
-    if (userId && !userApiKey && data.usage) {
-      const supabase = createClient(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    // Keep the raw body to return as-is; it's only parsed to read usage
+    const responseBody = await response.text()
+    const data = JSON.parse(responseBody)
 
+    // Track usage for billing (if user is authenticated)
+    if (userId && data.usage) {
       // Calculate cost (Anthropic pricing)
       const inputCost = (data.usage.input_tokens / 1000000) * 3  // $3 per 1M tokens
       const outputCost = (data.usage.output_tokens / 1000000) * 15  // $15 per 1M tokens
       const totalCost = inputCost + outputCost
 
-      await supabase.from('api_usage').insert({
-        user_id: userId,
-        tokens_used: data.usage.input_tokens + data.usage.output_tokens,
-        tokens_input: data.usage.input_tokens,
-        tokens_output: data.usage.output_tokens,
-        cost: totalCost,
-        model,
-        endpoint: '/functions/v1/claude-proxy',
-        created_at: new Date().toISOString()
-      })
+      // Record usage in the background so the insert doesn't delay the response
+      EdgeRuntime.waitUntil(
+        supabase.from('api_usage').insert({
+          user_id: userId,
+          tokens_used: data.usage.input_tokens + data.usage.output_tokens,
+          tokens_input: data.usage.input_tokens,
+          tokens_output: data.usage.output_tokens,
+          cost: totalCost,
+          model,
+          endpoint: '/functions/v1/claude-proxy',
+          created_at: new Date().toISOString()
+        }).then(({ error }) => {
+          if (error) console.error('Failed to track usage:', error)
+        })
+      )
     }
 
     return new Response(
-      JSON.stringify(data),
+      responseBody,
       {
         status: response.status,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' }
+        headers: jsonHeaders
       }
     )
 
@@ -153,7 +153,7 @@ serve(async (req) => {
       JSON.stringify({ error: error.message }),
       {
         status: 500,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' }
+        headers: jsonHeaders
       }
     )
   }
@@ -18,6 +18,8 @@ const WEBHOOK_SECRET = Deno.env.get('STRIPE_WEBHOOK_SECRET')!
 const SUPABASE_URL = Deno.env.get('SUPABASE_URL')!
 const SUPABASE_SERVICE_ROLE_KEY = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!
 
+const supabase = createClient(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
 /**
  * Handle successful checkout
  */
@@ -106,32 +108,20 @@ async function handleSubscriptionDeleted(
   subscription: Stripe.Subscription
 ) {
   try {
-    // Get billing record
-    const { data: billing } = await supabase
-      .from('billing')
-      .select('user_id')
-      .eq('stripe_subscription_id', subscription.id)
-      .single()
+    // Cancel billing and downgrade the tier in one transaction, so a retry
+    // after a partial failure can still find the subscription
+    const { data: userId, error } = await supabase
+      .rpc('cancel_subscription', { subscription_id_param: subscription.id })
 
-    if (!billing) {
-      console.error('Billing record not found for subscription:', subscription.id)
+    if (error) {
+      console.error('Error canceling subscription:', error)
       return
     }
 
-    // Update user settings to free tier
-    await supabase
-      .from('user_settings')
-      .update({ subscription_tier: 'free' })
-      .eq('user_id', billing.user_id)
-
-    // Update billing record
-    await supabase
-      .from('billing')
-      .update({
-        subscription_status: 'canceled',
-        stripe_subscription_id: null,
-      })
-      .eq('stripe_subscription_id', subscription.id)
+    if (!userId) {
+      console.error('Billing record not found for subscription:', subscription.id)
+      return
+    }
 
     console.log(` Subscription canceled: ${subscription.id}`)
   } catch (error) {
@@ -195,9 +185,6 @@ serve(async (req) => {
 
     console.log(`= Received Stripe webhook: ${event.type}`)
 
-    // Initialize Supabase client
-    const supabase = createClient(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-
     // Handle different event types
     switch (event.type) {
       case 'checkout.session.completed':
@@ -0,0 +1,20 @@
+-- ============================================================================
+-- CURSIVE - NOTEBOOK LIST INDEX
+-- Created: 2026-10-14
+-- ============================================================================
+-- The notebook lookup in legacy-static-site/static/js/sharingService.js
+-- (getOrCreateDefaultNotebook) filters on user_id, orders by created_at DESC
+-- and takes LIMIT 1. With only single-column indexes Postgres fetches every
+-- notebook for the user and sorts them. A composite index returns rows already
+-- in order, so the LIMIT stops after one.
+--
+-- The composite index has user_id as its leading column, so it also serves
+-- every lookup that idx_notebooks_user_id handled (including the RLS
+-- policies). The single-column index is dropped to avoid maintaining both on
+-- every notebook write.
+-- ============================================================================
+
+CREATE INDEX IF NOT EXISTS idx_notebooks_user_created
+  ON public.notebooks(user_id, created_at DESC);
+
+DROP INDEX IF EXISTS public.idx_notebooks_user_id;
@@ -0,0 +1,20 @@
+-- ============================================================================
+-- CURSIVE - SKIP NO-OP NOTEBOOK UPDATES
+-- Created: 2026-10-14
+-- ============================================================================
+-- Auto-save sends the same notebook fields again and again. Every such UPDATE
+-- still writes a new row version, and update_notebooks_updated_at bumps
+-- updated_at, so the notebook jumps to the top of the list even though
+-- nothing changed.
+--
+-- suppress_redundant_updates_trigger() is built into PostgreSQL. It drops the
+-- UPDATE when the new row is identical to the old one. Triggers fire in name
+-- order, so "suppress_..." runs before "update_notebooks_updated_at" and
+-- stops a no-op update before the timestamp is touched.
+-- ============================================================================
+
+DROP TRIGGER IF EXISTS suppress_redundant_notebook_updates ON public.notebooks;
+CREATE TRIGGER suppress_redundant_notebook_updates
+  BEFORE UPDATE ON public.notebooks
+  FOR EACH ROW
+  EXECUTE FUNCTION suppress_redundant_updates_trigger();
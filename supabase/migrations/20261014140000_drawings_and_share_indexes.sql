@@ -0,0 +1,22 @@
+-- ============================================================================
+-- CURSIVE - DRAWINGS ORDERING INDEX, DROP REDUNDANT SHARE INDEX
+-- Created: 2026-10-14
+-- ============================================================================
+-- Loading a notebook fetches its drawings ordered by created_at (the queries
+-- in legacy-static-site/static/js/sharingService.js). With separate
+-- notebook_id and created_at indexes Postgres either sorts the notebook's rows
+-- or bitmap-combines both indexes. A composite index returns them in order.
+-- notebook_id is its leading column, so it replaces idx_drawings_notebook_id
+-- for the RLS policies and the ON DELETE CASCADE from notebooks.
+--
+-- share_id is declared UNIQUE and therefore already has a full index, so a
+-- share lookup is a one-row probe of it. idx_notebooks_share_id duplicated
+-- that index and only added write cost, so it is dropped.
+-- ============================================================================
+
+CREATE INDEX IF NOT EXISTS idx_drawings_notebook_created
+  ON public.drawings(notebook_id, created_at DESC);
+
+DROP INDEX IF EXISTS public.idx_drawings_notebook_id;
+
+DROP INDEX IF EXISTS public.idx_notebooks_share_id;
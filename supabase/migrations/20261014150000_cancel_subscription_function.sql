@@ -0,0 +1,36 @@
+-- ============================================================================
+-- CURSIVE - ATOMIC SUBSCRIPTION CANCELLATION
+-- Created: 2026-10-14
+-- ============================================================================
+-- The customer.subscription.deleted webhook has to clear
+-- billing.stripe_subscription_id and downgrade user_settings.subscription_tier.
+-- As two separate requests, a failure between them left the subscription id
+-- cleared but the paid tier in place. Stripe's redelivery could then no longer
+-- find the billing row. This function does both writes in one transaction.
+--
+-- Only the service role (used by the webhook) may call it.
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION cancel_subscription(subscription_id_param TEXT)
+RETURNS UUID AS $$
+DECLARE
+  canceled_user_id UUID;
+BEGIN
+  UPDATE public.billing
+  SET
+    subscription_status = 'canceled',
+    stripe_subscription_id = NULL
+  WHERE stripe_subscription_id = subscription_id_param
+  RETURNING user_id INTO canceled_user_id;
+
+  IF canceled_user_id IS NOT NULL THEN
+    UPDATE public.user_settings
+    SET subscription_tier = 'free'
+    WHERE user_id = canceled_user_id;
+  END IF;
+
+  RETURN canceled_user_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+REVOKE EXECUTE ON FUNCTION cancel_subscription(TEXT) FROM PUBLIC, anon, authenticated;
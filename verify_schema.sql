@@ -1,19 +1,17 @@
 -- Verify the schema fixes were applied
 SELECT 'Checking notebooks table columns...' as step;
-SELECT column_name, data_type, is_nullable
-FROM information_schema.columns
-WHERE table_name = 'notebooks'
-AND table_schema = 'public'
-ORDER BY ordinal_position;
+SELECT a.attname AS column_name,
+       format_type(a.atttypid, a.atttypmod) AS data_type,
+       CASE WHEN a.attnotnull THEN 'NO' ELSE 'YES' END AS is_nullable
+FROM pg_attribute a
+WHERE a.attrelid = to_regclass('public.notebooks')
+AND a.attnum > 0
+AND NOT a.attisdropped
+ORDER BY a.attnum;
 
-SELECT 'Checking RLS policies on notebooks...' as step;
-SELECT policyname, cmd
+SELECT 'Checking RLS policies on notebooks and drawings...' as step;
+SELECT tablename, policyname, cmd
 FROM pg_policies
 WHERE schemaname = 'public'
-AND tablename = 'notebooks';
-
-SELECT 'Checking RLS policies on drawings...' as step;
-SELECT policyname, cmd
-FROM pg_policies
-WHERE schemaname = 'public'
-AND tablename = 'drawings';
+AND tablename IN ('notebooks', 'drawings')
+ORDER BY tablename, policyname;